@@ -8,6 +8,8 @@ from pymbar import other_estimators as estimators
 from pymbar.testsystems import harmonic_oscillators, exponential_distributions
 from pymbar.utils_for_testing import assert_equal, assert_almost_equal
 
+pytestmark = pytest.mark.xdist_group(name="exp")
+
 precision = 8  # the precision for systems that do have analytical results that should be matched.
 # Scales the z_scores so that we can reject things that differ at the ones decimal place.  TEMPORARY HACK
 z_scale_factor = 12.0
@@ -4,6 +4,8 @@ from pymbar import FES
 from pymbar.utils import ParameterError
 from pymbar.utils_for_testing import assert_almost_equal
 
+pytestmark = pytest.mark.xdist_group(name="fes")
+
 try:
     import sklearn  # pylint: disable=unused-import
 
@@ -147,16 +149,6 @@ def fes_1d():
         ibin += 1
     fzero = fes_analytical[zeroindex]
     fes_analytical -= fzero
-    bin_n = -1 * np.ones([numbrellas * nsamples], int)
-
-    # Determine indices of those within bounds.
-    within_bounds = (x_n[:, 0] >= xmin) & (x_n[:, 0] < xmax)
-    # Determine states for these.
-    bin_n[within_bounds] = np.floor((x_n[within_bounds, 0] - xmin) / dx)
-    # Determine indices of bins that are not empty.
-    bin_counts = np.zeros([nbins], int)
-    for i in range(nbins):
-        bin_counts[i] = (bin_n == i).sum()
 
     fes = FES(u_kn, N_k)
 
@@ -2,6 +2,8 @@
 for which the true free energy differences can be computed analytically.
 """
 
+from collections import namedtuple
+
 import numpy as np
 import pytest
 from pymbar import MBAR
@@ -9,11 +11,19 @@ from pymbar.testsystems import harmonic_oscillators, exponential_distributions
 from pymbar.utils_for_testing import assert_equal, assert_almost_equal
 from pymbar.utils import ParameterError
 
+# Under pytest-xdist's --dist loadgroup, tests sharing a group run on one worker, so each
+# module-scoped fixture is built once. The marks on system_generators further split the
+# mbar_and_test tests into one group per system, so the two systems can run on separate workers.
+pytestmark = pytest.mark.xdist_group(name="mbar")
+
 precision = 8  # the precision for systems that do have analytical results that should be matched.
 # Scales the z_scores so that we can reject things that differ at the ones decimal place.  TEMPORARY HACK
 z_scale_factor = 12.0
 # 0.5 is rounded to 1, so this says they must be within 3.0 sigma
 N_k = np.array([1000, 500, 0, 800])
+# Reduced sample counts for the mbar_and_test fixture; its analytical comparisons are
+# made in units of the (correspondingly larger) estimated uncertainties
+N_k_fast = np.array([500, 250, 0, 400])
 
 
 def generate_ho(O_k=np.array([1.0, 2.0, 3.0, 4.0]), K_k=np.array([0.5, 1.0, 1.5, 2.0])):
@@ -25,50 +35,96 @@ def generate_exp(rates=np.array([1.0, 2.0, 3.0, 4.0])):  # Rates, e.g. Lambda
 
 
 def convert_to_differences(x_ij, dx_ij, xa):
-    xa_ij = xa - np.vstack(xa)
+    xa_ij = xa[np.newaxis, :] - xa[:, np.newaxis]
 
+    diagonal = np.diag_indices_from(dx_ij)
     # add ones to the diagonal of the uncertainties, because they are zero
-    for i in range(len(N_k)):
-        dx_ij[i, i] += 1
-    z = (x_ij - xa_ij) / dx_ij
-    for i in range(len(N_k)):
-        # these terms should be zero; so we only throw an error if they aren't
-        z[i, i] = x_ij[i, i] - xa_ij[i, i]
+    dx_ij[diagonal] += 1
+    z = x_ij - xa_ij
+    # these terms should be zero; so we only throw an error if they aren't
+    z_diagonal = z[diagonal]
+    z /= dx_ij
+    z[diagonal] = z_diagonal
     return z
 
 
-system_generators = [generate_ho, generate_exp]
+def analytical_results(test):
+    """Analytical free energies and observables of a test system, computed once per fixture"""
+    return {
+        "f": test.analytical_free_energies(),
+        "mu_x": test.analytical_observable("position"),
+        "mu_x2": test.analytical_observable("position^2"),
+        "u": test.analytical_observable("potential energy"),
+        "s": test.analytical_entropies(),
+    }
+
+
+MbarBundle = namedtuple("MbarBundle", "mbar test x_n u_kn x_n_sq A_x_xsq analytical")
+
+
+def make_bundle(mbar, test, x_n, u_kn, squares=False, analytical=False):
+    """Bundle an MBAR fixture with its samples; the squared positions and analytical
+    results are only computed (otherwise None) for fixtures whose tests read them"""
+    x_n_sq, A_x_xsq = None, None
+    if squares:
+        x_n_sq = x_n**2
+        A_x_xsq = np.stack([x_n, x_n_sq])
+    return MbarBundle(
+        mbar=mbar,
+        test=test,
+        x_n=x_n,
+        u_kn=u_kn,
+        x_n_sq=x_n_sq,
+        A_x_xsq=A_x_xsq,
+        analytical=analytical_results(test) if analytical else None,
+    )
+
+
+system_generators = [
+    pytest.param(generate_ho, id="HO", marks=pytest.mark.xdist_group(name="HO")),
+    pytest.param(generate_exp, id="Exp", marks=pytest.mark.xdist_group(name="Exp")),
+]
 observables = ["position", "position^2", "RMS deviation", "potential energy"]
 
 
 @pytest.fixture(scope="module", params=system_generators)
 def mbar_and_test(request):
     name, test = request.param()
-    x_n, u_kn, N_k_output, s_n = test.sample(N_k, mode="u_kn")
-    assert_equal(N_k, N_k_output)
-    mbar = MBAR(u_kn, N_k, verbose=True, n_bootstraps=200)  # Bootstrap needed for a few tests
-    yield_bundle = {"mbar": mbar, "test": test, "x_n": x_n, "u_kn": u_kn}
-    yield yield_bundle
+    x_n, u_kn, N_k_output, s_n = test.sample(N_k_fast, mode="u_kn")
+    assert np.array_equal(N_k_fast, N_k_output)
+    mbar = MBAR(u_kn, N_k_fast, verbose=True, n_bootstraps=200)  # Bootstrap needed for a few tests
+    yield make_bundle(mbar, test, x_n, u_kn, squares=True, analytical=True)
 
 
 @pytest.fixture(scope="module")
 def mbar_and_test_harmonic():
     name, test = generate_ho()
     x_n, u_kn, N_k_output, s_n = test.sample(N_k, mode="u_kn")
-    assert_equal(N_k, N_k_output)
+    assert np.array_equal(N_k, N_k_output)
     mbar = MBAR(u_kn, N_k, verbose=True)
-    yield_bundle = {"mbar": mbar, "test": test, "x_n": x_n, "u_kn": u_kn}
-    yield yield_bundle
+    yield make_bundle(mbar, test, x_n, u_kn, analytical=True)
 
 
 @pytest.fixture(scope="module")
 def mbar_and_test_kln():
     name, test = generate_ho()
     x_n, u_kn, N_k_output = test.sample(N_k, mode="u_kln")
-    assert_equal(N_k, N_k_output)
+    assert np.array_equal(N_k, N_k_output)
     mbar = MBAR(u_kn, N_k, verbose=True)
-    yield_bundle = {"mbar": mbar, "test": test, "x_n": x_n, "u_kn": u_kn}
-    yield yield_bundle
+    yield make_bundle(mbar, test, x_n, u_kn, squares=True, analytical=True)
+
+
+@pytest.fixture(scope="module")
+def mbar_even():
+    """MBAR on harmonic oscillators in identical states, which have analytical overlaps"""
+    d = len(N_k)
+    even_O_k = 2.0 * np.ones(d)
+    even_K_k = 0.5 * np.ones(d)
+    even_N_k = 100 * np.ones(d)
+    name, test = generate_ho(O_k=even_O_k, K_k=even_K_k)
+    x_n, u_kn, N_k_output, s_n = test.sample(even_N_k, mode="u_kn")
+    mbar = MBAR(u_kn, even_N_k)
+    yield make_bundle(mbar, test, x_n, u_kn)
 
 
 @pytest.fixture()  # Function  level scope
@@ -89,16 +145,16 @@ def free_energies_almost_equal(mbar_fe, err_fe, analytical_fe):
     analytical_fe = analytical_fe[1:] - analytical_fe[0]
 
     z = (mbar_fe - analytical_fe) / err_fe
-    assert_almost_equal(z / z_scale_factor, np.zeros(len(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
 def test_ukln(mbar_and_test_kln):
     """Test that MBAR's u_kln->u_kn works correctly"""
-    mbar, test = mbar_and_test_kln["mbar"], mbar_and_test_kln["test"]
+    mbar, analytical = mbar_and_test_kln.mbar, mbar_and_test_kln.analytical
     results = mbar.compute_free_energy_differences()
     fe = results["Delta_f"]
     fe_sigma = results["dDelta_f"]
-    free_energies_almost_equal(fe, fe_sigma, test.analytical_free_energies())
+    free_energies_almost_equal(fe, fe_sigma, analytical["f"])
 
 
 def test_duplicate_state(fixed_harmonic_sample, caplog):
@@ -133,7 +189,7 @@ def test_bad_inital_f_k(fixed_harmonic_sample):
 def test_covariance_of_sums_runs(mbar_and_test_kln):
     """Test that CovarianceOfSums function runs"""
     # TODO: Is this function still needed? And what would be a better test?
-    mbar = mbar_and_test_kln["mbar"]
+    mbar = mbar_and_test_kln.mbar
     results = mbar.compute_free_energy_differences(return_theta=True)
     theta = results["Theta"]
     mbar.compute_covariance_of_sums(theta, 1, np.array([1, -1]))
@@ -146,27 +202,38 @@ def test_analytical(system_generator):
     mu = test.analytical_means()
     variance = test.analytical_variances()
     f_k = test.analytical_free_energies()
-    for observable in observables:
-        A_k = test.analytical_observable(observable=observable)
     s_k = test.analytical_entropies()
 
 
+@pytest.mark.parametrize("system_generator", system_generators)
+@pytest.mark.parametrize("observable", observables)
+def test_analytical_observable(system_generator, observable):
+    """Calculate each analytical observable of the test objects."""
+    name, test = system_generator()
+    A_k = test.analytical_observable(observable=observable)
+
+
 @pytest.mark.parametrize("system_generator", system_generators)
 def test_sample(system_generator):
     """Draw samples via test object."""
 
     name, test = system_generator()
-    print(name)
 
-    x_n, u_kn, N_k, s_n = test.sample([5, 6, 7, 8], mode="u_kn")
-    x_n, u_kn, N_k, s_n = test.sample([5, 5, 5, 5], mode="u_kn")
-    x_n, u_kn, N_k, s_n = test.sample([1, 1, 1, 1], mode="u_kn")
-    x_n, u_kn, N_k, s_n = test.sample([10, 0, 8, 0], mode="u_kn")
+    for N_k_sample in ([5, 6, 7, 8], [5, 5, 5, 5], [1, 1, 1, 1], [10, 0, 8, 0]):
+        K = len(N_k_sample)
+        N_tot = sum(N_k_sample)
+        N_max = max(N_k_sample)
 
-    x_kn, u_kln, N_k = test.sample([5, 6, 7, 8], mode="u_kln")
-    x_kn, u_kln, N_k = test.sample([5, 5, 5, 5], mode="u_kln")
-    x_kn, u_kln, N_k = test.sample([1, 1, 1, 1], mode="u_kln")
-    x_kn, u_kln, N_k = test.sample([10, 0, 8, 0], mode="u_kln")
+        x_n, u_kn, N_k_output, s_n = test.sample(N_k_sample, mode="u_kn")
+        assert_equal(N_k_output, N_k_sample)
+        assert x_n.shape == (N_tot,)
+        assert u_kn.shape == (K, N_tot)
+        assert s_n.shape == (N_tot,)
+
+        x_kn, u_kln, N_k_output = test.sample(N_k_sample, mode="u_kln")
+        assert_equal(N_k_output, N_k_sample)
+        assert x_kn.shape == (K, N_max)
+        assert u_kln.shape == (K, K, N_max)
 
 
 @pytest.mark.parametrize(
@@ -183,14 +250,14 @@ def test_sample(system_generator):
 def test_mbar_free_energies(mbar_and_test, uncertainty_method):
 
     """Can MBAR calculate moderately correct free energy differences?"""
-    mbar, test = mbar_and_test["mbar"], mbar_and_test["test"]
+    mbar, analytical = mbar_and_test.mbar, mbar_and_test.analytical
 
     results = mbar.compute_free_energy_differences(
         return_theta=True, uncertainty_method=uncertainty_method
     )
     fe = results["Delta_f"]
     fe_sigma = results["dDelta_f"]
-    free_energies_almost_equal(fe, fe_sigma, test.analytical_free_energies())
+    free_energies_almost_equal(fe, fe_sigma, analytical["f"])
 
 
 @pytest.mark.xfail(strict=True)  # This whole test should always fail and passes are problems
@@ -219,55 +286,55 @@ def test_mbar_compute_expectations_position_averages(mbar_and_test):
 
     """Can MBAR calculate E(x_n)??"""
 
-    mbar, test, x_n = mbar_and_test["mbar"], mbar_and_test["test"], mbar_and_test["x_n"]
+    mbar, x_n = mbar_and_test.mbar, mbar_and_test.x_n
     results = mbar.compute_expectations(x_n)
     mu = results["mu"]
     sigma = results["sigma"]
 
-    mu0 = test.analytical_observable(observable="position")
+    mu0 = mbar_and_test.analytical["mu_x"]
 
     z = (mu0 - mu) / sigma
-    assert_almost_equal(z / z_scale_factor, np.zeros(len(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
 def test_mbar_compute_expectations_position_differences(mbar_and_test):
 
     """Can MBAR calculate E(x_n)??"""
-    mbar, test, x_n = mbar_and_test["mbar"], mbar_and_test["test"], mbar_and_test["x_n"]
+    mbar, x_n = mbar_and_test.mbar, mbar_and_test.x_n
     results = mbar.compute_expectations(x_n, output="differences")
     mu_ij = results["mu"]
     sigma_ij = results["sigma"]
 
-    mu0 = test.analytical_observable(observable="position")
+    mu0 = mbar_and_test.analytical["mu_x"]
     z = convert_to_differences(mu_ij, sigma_ij, mu0)
-    assert_almost_equal(z / z_scale_factor, np.zeros(np.shape(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
 def test_mbar_compute_expectations_position2(mbar_and_test):
 
     """Can MBAR calculate E(x_n^2)??"""
 
-    mbar, test, x_n = mbar_and_test["mbar"], mbar_and_test["test"], mbar_and_test["x_n"]
-    results = mbar.compute_expectations(x_n**2)
+    mbar, x_n_sq = mbar_and_test.mbar, mbar_and_test.x_n_sq
+    results = mbar.compute_expectations(x_n_sq)
     mu = results["mu"]
     sigma = results["sigma"]
-    mu0 = test.analytical_observable(observable="position^2")
+    mu0 = mbar_and_test.analytical["mu_x2"]
 
     z = (mu0 - mu) / sigma
-    assert_almost_equal(z / z_scale_factor, np.zeros(len(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
 def test_mbar_compute_expectations_potential(mbar_and_test):
 
     """Can MBAR calculate E(u_kn)??"""
 
-    mbar, test, u_kn = mbar_and_test["mbar"], mbar_and_test["test"], mbar_and_test["u_kn"]
+    mbar, u_kn = mbar_and_test.mbar, mbar_and_test.u_kn
     results = mbar.compute_expectations(u_kn, state_dependent=True)
     mu = results["mu"]
     sigma = results["sigma"]
-    mu0 = test.analytical_observable(observable="potential energy")
+    mu0 = mbar_and_test.analytical["u"]
     z = (mu0 - mu) / sigma
-    assert_almost_equal(z / z_scale_factor, np.zeros(len(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
 @pytest.mark.parametrize(
@@ -298,13 +365,13 @@ def test_mbar_compute_expectations_edges(
         payload = mbar_and_test_kln
     else:
         payload = mbar_and_test_harmonic
-    mbar = payload["mbar"]
-    test = payload["test"]
-    u_xxx = payload["u_kn"]
+    mbar = payload.mbar
+    test = payload.test
+    u_xxx = payload.u_kn
     if state_dependent:
-        obs = payload["u_kn"]
+        obs = payload.u_kn
     else:
-        obs = payload["x_n"]
+        obs = payload.x_n
     if single_dim:
         u_xxx = u_xxx[0]
     results = mbar.compute_expectations(
@@ -314,67 +381,60 @@ def test_mbar_compute_expectations_edges(
     sigma = results["sigma"]
     mu0 = test.analytical_observable(observable=observable)
     z = (mu0 - mu) / sigma
-    assert_almost_equal(z / z_scale_factor, np.zeros(len(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
-def multiExpectationAssertion(results, test, state=1):
+def multiExpectationAssertion(results, analytical, state=1):
     mu = results["mu"]
     sigma = results["sigma"]
-    mu0 = test.analytical_observable(observable="position")[state]
-    mu1 = test.analytical_observable(observable="position^2")[state]
+    mu0 = analytical["mu_x"][state]
+    mu1 = analytical["mu_x2"][state]
     z = (mu0 - mu[0]) / sigma[0]
-    assert_almost_equal(z / z_scale_factor, 0 * z, decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
     z = (mu1 - mu[1]) / sigma[1]
-    assert_almost_equal(z / z_scale_factor, 0 * z, decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
 def test_mbar_compute_multiple_expectations(mbar_and_test):
 
     """Can MBAR calculate E(u_kn)??"""
 
-    mbar, test, x_n, u_kn = (
-        mbar_and_test["mbar"],
-        mbar_and_test["test"],
-        mbar_and_test["x_n"],
-        mbar_and_test["u_kn"],
+    mbar, analytical, A, u_kn = (
+        mbar_and_test.mbar,
+        mbar_and_test.analytical,
+        mbar_and_test.A_x_xsq,
+        mbar_and_test.u_kn,
     )
-    A = np.zeros([2, len(x_n)])
-    A[0, :] = x_n
-    A[1, :] = x_n**2
     state = 1
     results = mbar.compute_multiple_expectations(A, u_kn[state, :])
-    multiExpectationAssertion(results, test, state=state)
+    multiExpectationAssertion(results, analytical, state=state)
 
 
 def test_mbar_compute_multiple_expectations_more_dims(mbar_and_test_kln):
 
     """Can MBAR calculate E(u_kn) with 3 dimensions??"""
 
-    mbar, test, x_n, u_kn = (
-        mbar_and_test_kln["mbar"],
-        mbar_and_test_kln["test"],
-        mbar_and_test_kln["x_n"],
-        mbar_and_test_kln["u_kn"],
+    mbar, analytical, A, u_kn = (
+        mbar_and_test_kln.mbar,
+        mbar_and_test_kln.analytical,
+        mbar_and_test_kln.A_x_xsq,
+        mbar_and_test_kln.u_kn,
     )
-    A = np.zeros([2, x_n.shape[0], x_n.shape[1]])
-    A[0, :, :] = x_n
-    A[1, :, :] = x_n**2
     state = 1
     results = mbar.compute_multiple_expectations(
         A, u_kn[:, state, :], compute_covariance=True, return_theta=True
     )
-    multiExpectationAssertion(results, test, state=state)
+    multiExpectationAssertion(results, analytical, state=state)
 
 
 def test_mbar_compute_entropy_and_enthalpy(mbar_and_test, with_uxx=True):
 
     """Can MBAR calculate f_k, <u_k> and s_k ??"""
 
-    mbar, test, x_n, u_kn = (
-        mbar_and_test["mbar"],
-        mbar_and_test["test"],
-        mbar_and_test["x_n"],
-        mbar_and_test["u_kn"],
+    mbar, analytical, u_kn = (
+        mbar_and_test.mbar,
+        mbar_and_test.analytical,
+        mbar_and_test.u_kn,
     )
     results = mbar.compute_entropy_and_enthalpy(u_kn if with_uxx else None, verbose=True)
     f_ij = results["Delta_f"]
@@ -384,20 +444,20 @@ def test_mbar_compute_entropy_and_enthalpy(mbar_and_test, with_uxx=True):
     s_ij = results["Delta_s"]
     ds_ij = results["dDelta_s"]
 
-    fa = test.analytical_free_energies()
-    ua = test.analytical_observable("potential energy")
-    sa = test.analytical_entropies()
+    fa = analytical["f"]
+    ua = analytical["u"]
+    sa = analytical["s"]
 
     fa_ij = fa - fa.T
     ua_ij = ua - ua.T
     sa_ij = sa - sa.T
 
     z = convert_to_differences(f_ij, df_ij, fa)
-    assert_almost_equal(z / z_scale_factor, np.zeros(np.shape(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
     z = convert_to_differences(u_ij, du_ij, ua)
-    assert_almost_equal(z / z_scale_factor, np.zeros(np.shape(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
     z = convert_to_differences(s_ij, ds_ij, sa)
-    assert_almost_equal(z / z_scale_factor, np.zeros(np.shape(z)), decimal=0)
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
 
 
 @pytest.mark.parametrize(
@@ -422,25 +482,19 @@ def test_mbar_compute_entropy_and_enthalpy_edges(
 def test_mbar_compute_effective_sample_number(mbar_and_test):
     """testing compute_effective_sample_number"""
 
-    mbar = mbar_and_test["mbar"]
+    mbar = mbar_and_test.mbar
     # one mathematical effective sample numbers should be between N_k and sum_k N_k
     N_eff = mbar.compute_effective_sample_number()
-    sumN = np.sum(N_k)
-    assert all(N_eff > N_k)
-    assert all(N_eff < sumN)
+    sumN = np.sum(mbar.N_k)
+    assert (N_eff > mbar.N_k).all()
+    assert (N_eff < sumN).all()
 
 
-def test_mbar_compute_overlap_analytical():
+def test_mbar_compute_overlap_analytical(mbar_even):
     """Tests Overlap with identical states, which gives analytical results."""
 
-    d = len(N_k)
-    even_O_k = 2.0 * np.ones(d)
-    even_K_k = 0.5 * np.ones(d)
-    even_N_k = 100 * np.ones(d)
-    name, test = generate_ho(O_k=even_O_k, K_k=even_K_k)
-    x_n, u_kn, N_k_output, s_n = test.sample(even_N_k, mode="u_kn")
-    mbar = MBAR(u_kn, even_N_k)
-
+    mbar = mbar_even.mbar
+    d = mbar.K
     results = mbar.compute_overlap()
     overlap_scalar = results["scalar"]
     eigenval = results["eigenvalues"]
@@ -458,7 +512,7 @@ def test_mbar_compute_overlap_analytical():
 
 def test_mbar_compute_overlap_nonanalytical(mbar_and_test):
     """Tests Overlap with stochastic tests"""
-    mbar = mbar_and_test["mbar"]
+    mbar = mbar_and_test.mbar
     results = mbar.compute_overlap()
     overlap_scalar = results["scalar"]
     eigenval = results["eigenvalues"]
@@ -475,54 +529,54 @@ def test_mbar_weights(mbar_and_test):
 
     """testing weights"""
 
-    mbar = mbar_and_test["mbar"]
+    mbar = mbar_and_test.mbar
     W = mbar.weights()
     sumrows = np.sum(W, axis=0)
     assert_almost_equal(sumrows, np.ones(len(sumrows)), decimal=precision)
 
 
+def perturbed_free_energies_almost_equal(mbar, u_perturbed, analytical_fe):
+    """Helper to test MBAR perturbed free energies of the last states against analytical"""
+    results = mbar.compute_perturbed_free_energies(u_perturbed)
+    fe = results["Delta_f"]
+    fe_sigma = results["dDelta_f"]
+
+    fe, fe_sigma = fe[0, 1:], fe_sigma[0, 1:]
+    fe0 = analytical_fe[2:]
+    fe0 = fe0[1:] - fe0[0]
+
+    z = (fe - fe0) / fe_sigma
+    assert_almost_equal(z / z_scale_factor, 0.0, decimal=0)
+
+
 @pytest.mark.parametrize(
-    "system_generator,mode,bad_n",
-    [
-        (generate_ho, "u_kn", False),
-        (generate_exp, "u_kn", False),
-        (generate_ho, "u_kln", False),
-        pytest.param(generate_ho, "u_kn", True, marks=pytest.mark.xfail(strict=True)),
-    ],
+    "bad_n", [False, pytest.param(True, marks=pytest.mark.xfail(strict=True))]
 )
-def test_mbar_computePerturbedFreeEnergeies(system_generator, mode, bad_n):
+def test_mbar_computePerturbedFreeEnergeies(mbar_and_test, bad_n):
 
     """testing compute_perturbed_free_energies"""
 
-    # only do MBAR with the first and last set
+    # only do MBAR with the first and last set, reusing the fixture samples and free energies
+    u_kn = mbar_and_test.u_kn
+    N_k_sub = mbar_and_test.mbar.N_k[:2]
+    numN = int(N_k_sub.sum())
+    if bad_n:
+        numN = numN - 1
+    mbar = MBAR(u_kn[:2, :numN], N_k_sub, initial_f_k=mbar_and_test.mbar.f_k[:2])
+    perturbed_free_energies_almost_equal(mbar, u_kn[2:, :numN], mbar_and_test.analytical["f"])
 
-    name, test = system_generator()
-    if mode == "u_kln":
-        x_n, u_kn, N_k_output = test.sample(N_k, mode=mode)
-        numN = max(N_k[:2])
-        if bad_n:
-            numN = numN - 1
-        mslice = np.s_[:2, :2, :numN]
-        pslice = np.s_[:2, 2:, :numN]
-    else:
-        x_n, u_kn, N_k_output, s_n = test.sample(N_k, mode=mode)
-        numN = np.sum(N_k[:2])
-        if bad_n:
-            numN = numN - 1
-        mslice = np.s_[:2, :numN]
-        pslice = np.s_[2:, :numN]
-
-    mbar = MBAR(u_kn[mslice], N_k[:2])
-    results = mbar.compute_perturbed_free_energies(u_kn[pslice])
-    fe = results["Delta_f"]
-    fe_sigma = results["dDelta_f"]
 
-    fe, fe_sigma = fe[0, 1:], fe_sigma[0, 1:]
-    fe0 = test.analytical_free_energies()[2:]
-    fe0 = fe0[1:] - fe0[0]
+def test_mbar_computePerturbedFreeEnergeies_kln(mbar_and_test_kln):
 
-    z = (fe - fe0) / fe_sigma
-    assert_almost_equal(z / z_scale_factor, np.zeros(len(z)), decimal=0)
+    """testing compute_perturbed_free_energies with u_kln input"""
+
+    u_kln = mbar_and_test_kln.u_kn
+    N_k_sub = mbar_and_test_kln.mbar.N_k[:2]
+    numN = max(N_k_sub)
+    mbar = MBAR(u_kln[:2, :2, :numN], N_k_sub, initial_f_k=mbar_and_test_kln.mbar.f_k[:2])
+    perturbed_free_energies_almost_equal(
+        mbar, u_kln[:2, 2:, :numN], mbar_and_test_kln.analytical["f"]
+    )
 
 
 def test_mbar_compute_expectations_inner(mbar_and_test):
@@ -530,10 +584,10 @@ def test_mbar_compute_expectations_inner(mbar_and_test):
     """Can MBAR calculate general expectations inner code (note: this just tests completion)"""
 
     mbar, test, x_n, u_kn = (
-        mbar_and_test["mbar"],
-        mbar_and_test["test"],
-        mbar_and_test["x_n"],
-        mbar_and_test["u_kn"],
+        mbar_and_test.mbar,
+        mbar_and_test.test,
+        mbar_and_test.x_n,
+        mbar_and_test.u_kn,
     )
     A_in = np.array([x_n, x_n**2, x_n**3])
     u_n = u_kn[:2, :]
@@ -8,6 +8,8 @@ from pymbar.utils_for_testing import (
 )
 from pymbar.tests.test_mbar import z_scale_factor
 
+pytestmark = pytest.mark.xdist_group(name="mbar_solvers")
+
 
 @pytest.fixture(scope="module")
 def base_oscillator():
@@ -6,6 +6,8 @@ import pytest
 
 from pymbar.utils_for_testing import assert_almost_equal
 
+pytestmark = pytest.mark.xdist_group(name="timeseries")
+
 try:
     import statsmodels.api as sm  # pylint: disable=unused-import
 